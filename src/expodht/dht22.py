@@ -1,7 +1,11 @@
 # 2019-11-07
 # Public Domain
 import logging
+import threading
 import time
+from array import array
+from collections import namedtuple
+
 import pigpio
 
 _logger = logging.getLogger(__name__)
@@ -15,6 +19,34 @@ DHT_BAD_CHECKSUM = 1
 DHT_BAD_DATA = 2
 DHT_TIMEOUT = 3
 
+# Rising edges in a frame: the start edge, two response edges and 40 data bits.
+_FRAME_EDGES = 43
+
+# Valid DHT11 readings, indexed by temperature << 8 | humidity.
+_DHT11_VALID = bytes(
+    (t <= 60) and (9 <= h <= 90) for t in range(256) for h in range(256)
+)
+
+Datum = namedtuple("Datum", "timestamp gpio status temperature humidity")
+
+
+def _decode_frame(ticks, frame):
+    """
+    Decode the data bits of a frame from the ticks of its rising edges.
+
+    The bytes are written into frame in the order they were received.
+    Returns False if any bit had an invalid length.
+    """
+    lengths = [(ticks[i] - ticks[i - 1]) & 0xFFFFFFFF for i in range(3, _FRAME_EDGES)]
+    if (min(lengths) < 60) or (max(lengths) > 150):
+        return False
+    for n in range(5):
+        byte = 0
+        for edge_len in lengths[8 * n : 8 * n + 8]:
+            byte = (byte << 1) | (edge_len > 100)
+        frame[n] = byte
+    return True
+
 
 class Sensor:
     """
@@ -33,8 +65,8 @@ class Sensor:
         Optionally a callback may be specified.  If specified the
         callback will be called whenever a new reading is available.
 
-        The callback receives a tuple of timestamp, GPIO, status,
-        temperature, and humidity.
+        The callback receives a Datum named tuple of timestamp, GPIO,
+        status, temperature, and humidity.
 
         The timestamp will be the number of seconds since the epoch
         (start of 1970).
@@ -49,12 +81,17 @@ class Sensor:
         self._gpio = gpio
         self._model = model
         self._callback = callback
+        # DHT11 needs at least 18 ms of low start signal, DHTXX only 1 ms.
+        self._start_pulse = 0.001 if model == DHTXX else 0.018
+        self._validate = {
+            DHT11: self._validate_DHT11,
+            DHTXX: self._validate_DHTXX,
+        }.get(model, self._validate_auto)
 
-        self._new_data = False
-        self._in_code = False
+        self._new_data = threading.Event()
 
-        self._bits = 0
-        self._code = 0
+        self._ticks = array("I", [0] * _FRAME_EDGES)
+        self._code = bytearray(5)
 
         self._status = DHT_TIMEOUT
         self._timestamp = time.time()
@@ -62,11 +99,10 @@ class Sensor:
         self._humidity = 0.0
 
         pi.set_mode(gpio, pigpio.INPUT)
-        self._last_edge_tick = pi.get_current_tick() - 10000
-        self._cb_id = pi.callback(gpio, pigpio.RISING_EDGE, self._rising_edge)
+        self._cb_id = pi.callback(gpio, pigpio.RISING_EDGE, self._edge_callback())
 
     def _datum(self):
-        return (
+        return Datum(
             self._timestamp,
             self._gpio,
             self._status,
@@ -74,26 +110,25 @@ class Sensor:
             self._humidity,
         )
 
-    def _validate_DHT11(self, b1, b2, b3, b4):
-        t = b2
-        h = b4
-        if (b1 == 0) and (b3 == 0) and (t <= 60) and (h >= 9) and (h <= 90):
-            valid = True
-        else:
-            valid = False
+    def _validate_DHT11(self, frame):
+        h, b3, t, b1, _ = frame
+        valid = ((b1 | b3) == 0) and (_DHT11_VALID[(t << 8) | h] == 1)
         return (valid, t, h)
 
-    def _validate_DHTXX(self, b1, b2, b3, b4):
-        if b2 & 128:
-            div = -10.0
-        else:
-            div = 10.0
-        t = float(((b2 & 127) << 8) + b1) / div
-        h = float((b4 << 8) + b3) / 10.0
-        if (h <= 110.0) and (t >= -50.0) and (t <= 135.0):
-            valid = True
-        else:
-            valid = False
+    def _validate_DHTXX(self, frame):
+        raw_t = int.from_bytes(frame[2:4], "big")
+        sign = 1 - ((raw_t >> 15) << 1)
+        t = sign * (raw_t & 0x7FFF) / 10.0
+        h = int.from_bytes(frame[0:2], "big") / 10.0
+        valid = (h <= 110.0) & (-50.0 <= t <= 135.0)
+        return (valid, t, h)
+
+    def _validate_auto(self, frame):
+        # Try DHTXX first.
+        valid, t, h = self._validate_DHTXX(frame)
+        if not valid:
+            # try DHT11.
+            valid, t, h = self._validate_DHT11(frame)
         return (valid, t, h)
 
     def _decode_dhtxx(self):
@@ -117,25 +152,12 @@ class Sensor:
         DHT44 |      |      |      |      |      |
               +------+------+------+------+------+
         """
-        b0 = self._code & 0xFF
-        b1 = (self._code >> 8) & 0xFF
-        b2 = (self._code >> 16) & 0xFF
-        b3 = (self._code >> 24) & 0xFF
-        b4 = (self._code >> 32) & 0xFF
-
-        chksum = (b1 + b2 + b3 + b4) & 0xFF
-
-        if chksum == b0:
-            if self._model == DHT11:
-                valid, t, h = self._validate_DHT11(b1, b2, b3, b4)
-            elif self._model == DHTXX:
-                valid, t, h = self._validate_DHTXX(b1, b2, b3, b4)
-            else:  # AUTO
-                # Try DHTXX first.
-                valid, t, h = self._validate_DHTXX(b1, b2, b3, b4)
-                if not valid:
-                    # try DHT11.
-                    valid, t, h = self._validate_DHT11(b1, b2, b3, b4)
+        # The frame holds the bytes in the order they are received, so
+        # frame[0] is byte 4 in the table above and frame[4] the checksum.
+        frame = self._code
+
+        if (sum(frame[:4]) & 0xFF) == frame[4]:
+            valid, t, h = self._validate(frame)
             if valid:
                 self._temperature = t
                 self._humidity = h
@@ -144,40 +166,43 @@ class Sensor:
                 self._status = DHT_BAD_DATA
         else:
             self._status = DHT_BAD_CHECKSUM
-        self._new_data = True
-
-    def _rising_edge(self, gpio, level, tick):
-        edge_len = pigpio.tickDiff(self._last_edge_tick, tick)
-        self._last_edge_tick = tick
-        if edge_len > 10000:
-            self._in_code = True
-            self._bits = -2
-            self._code = 0
-        elif self._in_code:
-            self._bits += 1
-            if self._bits >= 1:
-                self._code <<= 1
-                if (edge_len >= 60) and (edge_len <= 150):
-                    if edge_len > 100:
-                        # 1 bit
-                        self._code += 1
-                else:
-                    # invalid bit
-                    self._in_code = False
-            if self._in_code:
-                if self._bits == 40:
-                    self._decode_dhtxx()
-                    self._in_code = False
+        self._new_data.set()
+
+    def _edge_callback(self):
+        """
+        Build the rising edge callback.
+
+        The callback runs once per edge, so its state lives in closure
+        variables instead of instance attributes. Tick differences are
+        computed inline, ticks wrap around every 2**32 microseconds.
+        """
+        frame_edges = _FRAME_EDGES
+        ticks = self._ticks
+        code = self._code
+        decode_frame = _decode_frame
+        decode = self._decode_dhtxx
+        last_tick = self._pi.get_current_tick() - 10000
+        edges = frame_edges
+
+        def _rising_edge(gpio, level, tick):
+            nonlocal last_tick, edges
+            if ((tick - last_tick) & 0xFFFFFFFF) > 10000:
+                edges = 0
+            last_tick = tick
+            if edges < frame_edges:
+                ticks[edges] = tick
+                edges += 1
+                if (edges == frame_edges) and decode_frame(ticks, code):
+                    decode()
+
+        return _rising_edge
 
     def _trigger(self):
-        self._new_data = False
+        self._new_data.clear()
         self._timestamp = time.time()
         self._status = DHT_TIMEOUT
         self._pi.write(self._gpio, 0)
-        if self._model != DHTXX:
-            time.sleep(0.018)
-        else:
-            time.sleep(0.001)
+        time.sleep(self._start_pulse)
         self._pi.set_mode(self._gpio, pigpio.INPUT)
 
     def cancel(self):
@@ -190,8 +215,8 @@ class Sensor:
         """
         This triggers a read of the sensor.
 
-        The returned data is a tuple of timestamp, GPIO, status,
-        temperature, and humidity.
+        The returned data is a Datum named tuple of timestamp, GPIO,
+        status, temperature, and humidity.
 
         The timestamp will be the number of seconds since the epoch
         (start of 1970).
@@ -203,10 +228,7 @@ class Sensor:
         3 DHT_TIMEOUT (no response from sensor)
         """
         self._trigger()
-        for i in range(5):  # timeout after 0.25 seconds.
-            time.sleep(0.05)
-            if self._new_data:
-                break
+        self._new_data.wait(timeout=0.25)
         datum = self._datum()
         if self._callback is not None:
             self._callback(datum)
@@ -1,8 +1,12 @@
-from os import environ
+from os import environ, getpid
+from itertools import cycle
 from random import uniform
+from signal import SIGTERM, signal
 from time import sleep
 
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import start_http_server, Gauge, CollectorRegistry, REGISTRY
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.multiprocess import MultiProcessCollector, mark_process_dead
 from logging import getLogger, basicConfig, NOTSET
 from pigpio import pi
 from expodht.dht22 import Sensor
@@ -10,31 +14,93 @@ from expodht.dht22 import Sensor
 basicConfig(level=NOTSET)
 _logger = getLogger(__name__)
 
-TEMPERATURE = Gauge("dht22_temperature", "Temperature (Celsius) as read by the sensor")
-HUMIDITY = Gauge("dht22_humidity", "Relative humidity as read by the sensor")
+TEMPERATURE = ("dht22_temperature", "Temperature (Celsius) as read by the sensor")
+HUMIDITY = ("dht22_humidity", "Relative humidity as read by the sensor")
 
-GPIO = environ.get("GPIO_PIN", 4)
-INTERVAL = environ.get("INTERVAL_SECONDS", 10)
-HTTP_PORT = environ.get("HTTP_PORT", 9200)
+GPIO = int(environ.get("GPIO_PIN", 4))
+INTERVAL = float(environ.get("INTERVAL_SECONDS", 10))
+HTTP_PORT = int(environ.get("HTTP_PORT", 9200))
 HTTP_ADDR = environ.get("HTTP_ADDR", "0.0.0.0")
 DUMMY_MODE = environ.get("DUMMY_MODE")
+MULTIPROC_DIR = environ.get("PROMETHEUS_MULTIPROC_DIR")
 
 
-def dummy_read_metrics():
-    return round(uniform(15, 30), 2), round(uniform(15, 30), 2)
+def dummy_read_metrics(samples=4096):
+    readings = [
+        (round(uniform(15, 30), 2), round(uniform(15, 30), 2)) for _ in range(samples)
+    ]
+    return cycle(readings).__next__
+
+
+class DHTCollector:
+    """
+    Exposes the last reading stored with update().
+
+    Unlike Gauge.set, storing a reading takes no lock. The values are only
+    wrapped into metric families when the endpoint is scraped.
+    """
+
+    def __init__(self):
+        self._reading = (0.0, 0.0)
+
+    def update(self, temp, hum):
+        self._reading = (temp, hum)
+
+    def collect(self):
+        temp, hum = self._reading
+        yield GaugeMetricFamily(*TEMPERATURE, value=temp)
+        yield GaugeMetricFamily(*HUMIDITY, value=hum)
+
+
+def register_metrics():
+    """
+    Returns the registry to serve and a function storing a reading in it.
+    """
+    if not MULTIPROC_DIR:
+        collector = DHTCollector()
+        REGISTRY.register(collector)
+        return REGISTRY, collector.update
+
+    registry = CollectorRegistry()
+    MultiProcessCollector(registry)
+    # The pid label changes on every restart, gpio identifies the sensor.
+    temperature = Gauge(
+        *TEMPERATURE,
+        labelnames=("gpio",),
+        multiprocess_mode="liveall",
+        registry=None,
+    ).labels(gpio=GPIO)
+    humidity = Gauge(
+        *HUMIDITY,
+        labelnames=("gpio",),
+        multiprocess_mode="liveall",
+        registry=None,
+    ).labels(gpio=GPIO)
+
+    def _update(temp, hum):
+        temperature.set(temp)
+        humidity.set(hum)
+
+    return registry, _update
+
+
+def _terminate(signum, frame):
+    # Turn SIGTERM into SystemExit so cleanup in finally blocks runs.
+    raise SystemExit(0)
 
 
 def dht_read_metrics(sensor):
     def _read():
-        _, _, _, temp, hum = sensor.read()
-        return temp, hum
+        datum = sensor.read()
+        return datum.temperature, datum.humidity
 
     return _read
 
 
 def main():
-    read_metrics = dummy_read_metrics
-    if not DUMMY_MODE:
+    if DUMMY_MODE:
+        read_metrics = dummy_read_metrics()
+    else:
         gpiod = pi()
         if not gpiod.connected:
             _logger.error("Connection to pigpiod failed. Exiting now")
@@ -43,19 +109,26 @@ def main():
         sensor = Sensor(gpiod, GPIO)
         read_metrics = dht_read_metrics(sensor)
 
-    start_http_server(HTTP_PORT, HTTP_ADDR)
+    registry, update_metrics = register_metrics()
+    if MULTIPROC_DIR:
+        signal(SIGTERM, _terminate)
+        _logger.info("Sharing metrics through %s", MULTIPROC_DIR)
+
+    start_http_server(HTTP_PORT, HTTP_ADDR, registry)
     _logger.info("Listening on %s:%d", HTTP_ADDR, HTTP_PORT)
     if DUMMY_MODE:
         _logger.info(
             "Running in dummy mode. Metrics will be updated every %s seconds", INTERVAL
         )
     else:
-        _logger.info("Will read on GPIO %d every %d seconds", GPIO, INTERVAL)
-    while True:
-        temp, hum = read_metrics()
-        TEMPERATURE.set(temp)
-        HUMIDITY.set(hum)
-        sleep(INTERVAL)
+        _logger.info("Will read on GPIO %d every %s seconds", GPIO, INTERVAL)
+    try:
+        while True:
+            update_metrics(*read_metrics())
+            sleep(INTERVAL)
+    finally:
+        if MULTIPROC_DIR:
+            mark_process_dead(getpid())
 
 
 if __name__ == "__main__":